@@ -1,14 +1,29 @@
 import argparse
 import csv
+import errno
+import functools
+import os
 import re
 import shutil
+from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
-from typing import NamedTuple, Optional, Self
+from typing import Callable, Iterable, NamedTuple, Optional, Self, TypeVar
+
+_T = TypeVar("_T")
+
+_SEASON_DIR = re.compile(r"Season \d+")
+
+
+def _suffix_lower(name: str) -> str:
+    # same result as PurePath(name).suffix.lower() without building a path;
+    # a leading dot marks a hidden file, not a suffix
+    i = name.rfind(".")
+    return name[i:].lower() if 0 < i < len(name) - 1 else ""
 
 
 class SubtitleLocaleFixer:
 
-    SUFFIXES = ('.ass', '.ssa', '.sup', '.srt')
+    SUFFIXES = frozenset(('.ass', '.ssa', '.sup', '.srt'))
 
     class Rule(NamedTuple):
         source: str
@@ -17,52 +32,115 @@ class SubtitleLocaleFixer:
 
         @classmethod
         def from_csv(cls, path: Path) -> list[Self]:
-            rules = []
-            with Path(path).open(encoding="utf-8") as f:
-                for row in csv.DictReader(f):
-                    rules.append(cls(
-                        source=row["source"],
-                        target=row["target"],
-                        case_sensitive=row.get(
-                            "is_case_sensitive", "false").lower() == "true"
-                    ))
+            with Path(path).open(encoding="utf-8", newline="") as f:
+                reader = csv.reader(f)
+                header = next(reader, None)
+                if header is None:
+                    return []
+
+                i_src = header.index("source")
+                i_tgt = header.index("target")
+                i_cs = (header.index("is_case_sensitive")
+                        if "is_case_sensitive" in header else None)
+
+                return [
+                    cls(
+                        source=row[i_src],
+                        target=row[i_tgt],
+                        case_sensitive=(i_cs is not None
+                                        and row[i_cs].lower() == "true"))
+                    for row in reader if row
+                ]
 
     def __init__(self, rules: list[Rule] = None, default_locale: Optional[str] = None):
-        self.rules: list[SubtitleLocaleFixer.Rule] = rules or []
+        self.rules = rules or ()
         self.default_locale: Optional[str] = default_locale
 
+    @property
+    def rules(self) -> tuple[Rule, ...]:
+        # the lookup maps are built from this, so it is stored immutable to
+        # keep in-place edits from leaving them stale; assign to change it
+        return self._rules
+
+    @rules.setter
+    def rules(self, rules: Iterable[Rule]):
+        self._rules = tuple(rules)
+        # earlier rules take precedence (CLI rules come before CSV ones), so
+        # keep the position of the first rule per source alongside its target
+        self._cs_map: dict[str, tuple[int, str]] = {}
+        self._ci_map: dict[str, tuple[int, str]] = {}
+        for i, (src, tgt, case_sensitive) in enumerate(self._rules):
+            if case_sensitive:
+                self._cs_map.setdefault(src, (i, tgt))
+            else:
+                self._ci_map.setdefault(src.lower(), (i, tgt))
+        # cached results depend on the rules, so start a fresh cache
+        self._fix_cached = functools.lru_cache(maxsize=4096)(self._fix)
+
     def fix_name(self, filename: str) -> str:
-        parts = filename.rsplit(".", 2)
+        return self._fix_cached(filename, self.default_locale)
 
-        if len(parts) == 3:
-            name, lang, ext = parts
-        elif len(parts) == 2:
-            name, ext = parts
-            lang = None
-        else:
+    def _fix(self, filename: str, default_locale: Optional[str]) -> str:
+        # slice around the last two dots rather than rsplit(".", 2), which
+        # allocates a list per call
+        i = filename.rfind(".")
+        if i < 0:
             return filename
+        ext = filename[i + 1:]
 
-        if lang:
-            for src, tgt, case_sensitive in self.rules:
-                if ((case_sensitive and lang == src)
-                        or (not case_sensitive and lang.lower() == src.lower())):
-                    return f"{name}.{tgt}.{ext}"
+        j = filename.rfind(".", 0, i)
+        if j >= 0:
+            name, lang = filename[:j], filename[j + 1:i]
+        else:
+            name, lang = filename[:i], None
 
-        if self.default_locale and lang is None:
-            return f"{name}.{self.default_locale}.{ext}"
+        if lang:
+            hit = self._cs_map.get(lang)
+            if self._ci_map:
+                ci_hit = self._ci_map.get(lang.lower())
+                if ci_hit is not None and (hit is None or ci_hit < hit):
+                    hit = ci_hit
+            if hit is not None:
+                return f"{name}.{hit[1]}.{ext}"
+
+        if default_locale and lang is None:
+            return f"{name}.{default_locale}.{ext}"
         return filename
 
 
 class MediaOrganizer:
+
+    ORGANIZE_WORKERS = 8
+    MOVE_WORKERS = 16
+    MIN_PARALLEL_MOVES = 8
+
     def __init__(self, target: Path, sub_fixer: SubtitleLocaleFixer):
         self.target = target.resolve()
         self.sub_fixer = sub_fixer
+        self._mkdir_cache: set[str] = set()
+        # shared by every organize call; threads are only started when needed
+        self._move_executor = ThreadPoolExecutor(
+            max_workers=self.MOVE_WORKERS)
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._move_executor.shutdown()
 
     def process_interactive(self):
-        for item in sorted(self.target.iterdir()):
-            if not item.is_dir():
-                continue
-            print(f"\nDirectory: {item.name}")
+        # ask for every directory first so the moves can run without waiting
+        # on the user in between
+        work: list[tuple[str, Path]] = []
+        with os.scandir(self.target) as it:
+            entries = sorted((e for e in it if e.is_dir()),
+                             key=lambda e: e.name)
+
+        for entry in entries:
+            print(f"\nDirectory: {entry.name}")
             season_input = input(
                 "Season number (number / s=skip / q=quit): ").strip().lower()
 
@@ -71,32 +149,164 @@ class MediaOrganizer:
             if season_input == "s":
                 continue
 
-            self.organize_directory(season=season_input, directory=item)
+            work.append((season_input, Path(entry.path)))
+
+        # every directory is organized within its own subtree; let all of them
+        # run so one failing show does not cancel the ones queued after it
+        with ThreadPoolExecutor(max_workers=self.ORGANIZE_WORKERS) as executor:
+            futures = {
+                executor.submit(self.organize_directory,
+                                season=season, directory=directory): directory
+                for season, directory in work}
+            wait(futures)
+
+        errors: list[Exception] = []
+        for future, directory in futures.items():
+            if (e := future.exception()) is not None:
+                print(f"Failed to organize {directory.name}: {e}")
+                errors.append(e)
+        if errors:
+            raise ExceptionGroup(
+                f"{len(errors)} of {len(work)} directories failed", errors)
 
     def organize_directory(self, season: str, directory: Path = None):
         if not directory:
             directory = self.target
 
-        dir_season = directory.joinpath(f"Season {season}")
-        dir_extra = directory.joinpath("EXTRA", f"Season {season}")
-
-        dir_season.mkdir(exist_ok=True)
-        dir_extra.mkdir(exist_ok=True)
-
-        for f in [p for p in directory.iterdir()
-                  if p.is_file() and p.suffix in self.sub_fixer.SUFFIXES]:
-            shutil.move(f, self.sub_fixer.fix_name(f.name))
-
-        for d in [p for p in directory.iterdir() if p.is_dir()]:
-            shutil.move(d, dir_extra)
-
-        # for f in [p for p in directory.iterdir() if p.is_file()]:
+        directory_str = os.fspath(directory)
+        season_name = f"Season {season}"
+        dir_season = os.path.join(directory_str, season_name)
+        dir_extra = os.path.join(directory_str, "EXTRA", season_name)
+
+        self._ensure_dir(dir_season)
+        self._ensure_dir(dir_extra)
+
+        # classify entries in a single pass; DirEntry caches the file type
+        subs: list[os.DirEntry] = []
+        dirs: list[os.DirEntry] = []
+        files: list[os.DirEntry] = []
+        with os.scandir(directory_str) as it:
+            for entry in it:
+                if entry.is_dir():
+                    # leave EXTRA and every season directory alone, including
+                    # ones organized under a different season earlier
+                    if (entry.name != "EXTRA" and entry.path != dir_season
+                            and not _SEASON_DIR.fullmatch(entry.name)):
+                        dirs.append(entry)
+                elif entry.is_file():
+                    if _suffix_lower(entry.name) in self.sub_fixer.SUFFIXES:
+                        subs.append(entry)
+                    else:
+                        files.append(entry)
+
+        self._move_subtitles(subs, dir_season)
+
+        # shutil.move re-checks the destination on every call before falling
+        # back to a copy; on a single filesystem a plain rename is enough
+        if dirs:
+            same_dev = (os.stat(directory_str).st_dev
+                        == os.stat(dir_extra).st_dev)
+            for d in dirs:
+                self._move_extra(d, dir_extra, same_dev)
+
+        # for f in files:
         #     search = re.search(r'\[\d{1,2}\]|\s\d{2}(?=\s|$)|S\d+E\d+', f.name)
         #     if not search:
         #         pass
 
-        for f in [p for p in directory.iterdir() if p.is_file()]:
-            shutil.move(d,  dir_season)
+        self._move_videos(files, dir_season)
+
+    def _move_extra(self, d: os.DirEntry, dest: str, same_dev: bool) -> None:
+        if not same_dev:
+            shutil.move(d.path, dest)
+            return
+
+        target = os.path.join(dest, d.name)
+        # os.rename would replace an empty directory, keep shutil.move's error
+        if os.path.lexists(target):
+            raise shutil.Error(f"Destination path '{target}' already exists")
+        try:
+            os.rename(d.path, target)
+        except OSError as e:
+            # the directory itself may be a mount point
+            if e.errno != errno.EXDEV:
+                raise
+            shutil.move(d.path, dest)
+
+    def _ensure_dir(self, path: str) -> None:
+        if path not in self._mkdir_cache:
+            os.makedirs(path, exist_ok=True)
+            self._mkdir_cache.add(path)
+
+    def _move_videos(self, files: list[os.DirEntry], dest: str) -> None:
+        self._run_moves(lambda f: self._move_video(f, dest), files)
+
+    def _move_video(self, f: os.DirEntry, dest: str) -> None:
+        target = os.path.join(dest, f.name)
+        # os.rename would replace an episode from an earlier run, keep
+        # shutil.move's error
+        if os.path.lexists(target):
+            raise shutil.Error(f"Destination path '{target}' already exists")
+        try:
+            os.rename(f.path, target)
+        except OSError as e:
+            # the season directory may be a mount point
+            if e.errno != errno.EXDEV:
+                raise
+            shutil.copy2(f.path, target)
+            os.unlink(f.path)
+
+    def _move_subtitles(self, files: list[os.DirEntry], dest: str) -> None:
+        # different subtitles can fix to the same name (e.g. ep01.srt and
+        # ep01.en.srt with a default locale of en); resolve those in scan
+        # order before moving so the outcome does not depend on thread timing
+        moves: list[tuple[os.DirEntry, str]] = []
+        claimed: dict[str, os.DirEntry] = {}
+        for f in files:
+            target = os.path.join(dest, self.sub_fixer.fix_name(f.name))
+            if (owner := claimed.get(target)) is not None:
+                print(f"Skipped {f.path}: {owner.name} is also renamed to "
+                      f"{target}")
+                continue
+            claimed[target] = f
+            moves.append((f, target))
+
+        self._run_moves(lambda m: self._move_subtitle(*m), moves)
+
+    def _move_subtitle(self, f: os.DirEntry, target: str) -> None:
+        # never overwrite, the target may be left from an earlier run
+        if os.path.lexists(target):
+            print(f"Skipped {f.path}: {target} already exists")
+            return
+        try:
+            os.rename(f.path, target)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # copy2 goes through copyfile, which uses sendfile where available
+            shutil.copy2(f.path, target)
+            os.unlink(f.path)
+
+    def _run_moves(self, move: Callable[[_T], None], items: list[_T]) -> None:
+        # renames release the GIL, so overlapping them hides per-call latency
+        # on network and spinning storage; a handful is not worth the hand-off
+        # every move is attempted before any error is raised, so which files
+        # are left behind does not depend on thread timing
+        errors: list[Exception] = []
+        if len(items) < self.MIN_PARALLEL_MOVES:
+            for item in items:
+                try:
+                    move(item)
+                except Exception as e:
+                    errors.append(e)
+        else:
+            futures = [self._move_executor.submit(move, item) for item in items]
+            wait(futures)
+            errors.extend(e for future in futures
+                          if (e := future.exception()) is not None)
+        if errors:
+            raise ExceptionGroup(
+                f"{len(errors)} of {len(items)} moves failed", errors)
 
     def _generate_nfo(self, files: list[Path], season: int, ep_offset: int = 0) -> None:
         for i, path in enumerate(files, 1):
@@ -149,12 +359,11 @@ def main():
         fixer.default_locale = args.default_locale
         fixer.rules = mappings
 
-    organizer = MediaOrganizer(target=args.target, sub_fixer=fixer)
-
-    if args.interactive:
-        organizer.process_interactive()
-    else:
-        organizer.organize_directory(args.season)
+    with MediaOrganizer(target=args.target, sub_fixer=fixer) as organizer:
+        if args.interactive:
+            organizer.process_interactive()
+        else:
+            organizer.organize_directory(args.season)
 
 
 if __name__ == "__main__":